@@ -0,0 +1 @@
+# gnidart
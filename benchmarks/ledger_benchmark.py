@@ -0,0 +1,81 @@
+"""
+    Compares Position.add_transaction, which books fills through the FIFO lot ledger, against the average cost
+    bookkeeping Position used before. Run with `python3 -m benchmarks.ledger_benchmark [fills]`.
+"""
+import sys
+import time
+
+import numpy as np
+
+from library.order import Transaction
+from library.portfolio import Position
+
+
+class AverageCostPosition(Position):
+    # Position.add_transaction as it was before the lot ledger, plus the realized P&L against the average cost
+    def __init__(self, stock: str, price: float, shares: float = 0) -> None:
+        super().__init__(stock, price, shares, lots=False)
+        self._realized = 0.
+
+    @property
+    def realized_pnl(self) -> float:
+        return self._realized
+
+    def add_transaction(self, txn: Transaction, lot: int = None) -> None:
+        if self._stock != txn.stock:
+            raise ValueError("Transaction stock ticker must be the same as position ticker")
+
+        if self._shares + txn.shares < 0:
+            raise ValueError("Transaction can not sell more shares than current position")
+
+        if txn.is_buy():
+            total_cost = self._cost_per_share * self._shares + txn.price * txn.shares
+            self._shares += txn.shares
+            if self._shares > 1e-7:
+                self._cost_per_share = total_cost / self._shares
+        else:
+            self._realized -= txn.shares * (txn.price - self._cost_per_share)
+            self._shares += txn.shares
+
+        self._price = txn.price
+
+
+def generate_fills(count, seed=0):
+    # Random walk of prices with mostly buys, so that lots build up and get matched in bulk
+    rng = np.random.default_rng(seed)
+    prices = 100 * np.exp(np.cumsum(rng.normal(0, .01, size=count)))
+    shares = np.round(rng.uniform(1, 100, size=count))
+    sells = rng.random(count) < .4
+
+    # Sells never exceed the shares held, as validated by the Controller
+    held = 0.
+    fills = []
+    for price, delta, sell in zip(prices.tolist(), shares.tolist(), sells.tolist()):
+        if sell:
+            delta = -min(delta, held)
+            if delta == 0:
+                continue
+        held += delta
+        fills.append(Transaction('TICK', price, delta, 0.))
+    return fills
+
+
+def run(position, fills):
+    start = time.perf_counter()
+    for txn in fills:
+        position.add_transaction(txn)
+    return time.perf_counter() - start
+
+
+def main(count):
+    fills = generate_fills(count)
+    for name, position in (('average cost', AverageCostPosition('TICK', fills[0].price)),
+                           ('fifo ledger', Position('TICK', fills[0].price))):
+        elapsed = run(position, fills)
+        print('%-12s : %d fills in %.3fs (%.0f ns/fill), shares %.0f, cost per share $%.2f, realized $%.2f' % (
+            name, len(fills), elapsed, 1e9 * elapsed / len(fills), position.shares, position.cost_per_share,
+            position.realized_pnl))
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 1000000)
@@ -8,15 +8,38 @@ class Algorithm:
     Algorithm for trading. Must implement a "generate_orders" function which returns a list of orders.
     """
 
-    def __init__(self):
+    def __init__(self, price_window=20, ema_lambda=.5, minimum_wait_between_trades=5):
+        if minimum_wait_between_trades >= price_window:
+            raise ValueError("Minimum wait between trades must be less than the price window")
+
         self._averages = {}
-        self._lambda = .5
+        self._lambda = ema_lambda
         self._updates = 0
-        self._price_window = 20
+        self._price_window = price_window
         self._trend = np.zeros(self._price_window)
-        self._minimum_wait_between_trades = 5  # Must be less than price window
+        self._minimum_wait_between_trades = minimum_wait_between_trades
         self._last_trade = 0
         self._last_date = None
+        self._indicators = None
+        self._latest = {}
+
+    def parameters(self):
+        # Constructor arguments which recreate this algorithm without its trading state
+        return {'price_window': self._price_window, 'ema_lambda': self._lambda,
+                'minimum_wait_between_trades': self._minimum_wait_between_trades}
+
+    def indicator_parameters(self):
+        # Parameters for an IndicatorEngine which can serve this algorithm
+        return {'windows': (self._price_window,), 'ema_lambda': self._lambda, 'volatility_window': self._price_window}
+
+    def set_indicators(self, indicators):
+        """
+        Looks up the window averages from precomputed indicators instead of keeping a price history per stock.
+        Prices must then be updated together with their timestamp.
+        """
+        if indicators is not None and 'sma_%d' % self._price_window not in indicators:
+            raise ValueError("Indicators must include the moving average over the price window")
+        self._indicators = indicators
 
     def add_stock(self, stock, price):
         self._averages[stock] = price
@@ -51,7 +74,8 @@ class Algorithm:
         if not self._determine_if_trading(timestamp, portfolio_value, cash_balance):
             return orders
 
-        valid_stocks = [stock for stock in self._averages if portfolio.get_update_count(stock) > self._price_window]
+        stocks = self._latest if self._indicators is not None else self._averages
+        valid_stocks = [stock for stock in stocks if portfolio.get_update_count(stock) > self._price_window]
 
         if len(valid_stocks) == 0:
             return orders
@@ -80,10 +104,17 @@ class Algorithm:
         return orders
 
     def get_window_average(self, stock):
+        if self._indicators is not None:
+            row, _ = self._latest[stock]
+            return self._indicators.sma(self._price_window, row, self._indicators.column(stock))
         return np.mean(self._averages[stock]['history'])
 
-    def update(self, stock, price):
-        if stock in self._averages:
+    def update(self, stock, price, timestamp=None):
+        if self._indicators is not None:
+            if timestamp is None:
+                raise ValueError("Timestamp is required when using precomputed indicators")
+            self._latest[stock] = (self._indicators.row(timestamp), price)
+        elif stock in self._averages:
             self.add_price(stock, price)
         else:
             length = self._price_window
@@ -92,6 +123,8 @@ class Algorithm:
             data[0] = price
 
     def get_price(self, stock):
+        if self._indicators is not None:
+            return self._latest[stock][1]
         # Assumes history is full
         return self._averages[stock]['history'][-1]
 
@@ -0,0 +1,175 @@
+import hashlib
+import os
+import shutil
+import tempfile
+from collections import OrderedDict
+
+import numpy as np
+
+
+def rolling_mean(values, window):
+    """
+    Rolling mean along the first axis, NaN until the window is full.
+    """
+    values = np.asarray(values, dtype=float)
+    result = np.full(values.shape, np.nan)
+    if len(values) >= window:
+        sums = np.cumsum(np.concatenate([np.zeros((1,) + values.shape[1:]), values]), axis=0)
+        result[window - 1:] = (sums[window:] - sums[:-window]) / window
+    return result
+
+
+def rolling_std(values, window):
+    """
+    Rolling sample standard deviation along the first axis, NaN until the window is full.
+    """
+    values = np.asarray(values, dtype=float)
+    mean = rolling_mean(values, window)
+    variance = (rolling_mean(values ** 2, window) - mean ** 2) * window / max(window - 1, 1)
+    return np.sqrt(np.maximum(variance, 0))
+
+
+def exponential_mean(prices, ema_lambda):
+    """
+    Exponential moving average of a (timestamps x tickers) price matrix, seeded with the first price of each ticker.
+    Missing prices carry the previous average forward.
+    """
+    prices = np.asarray(prices, dtype=float)
+    result = np.full(prices.shape, np.nan)
+    previous = np.full(prices.shape[1:], np.nan)
+    for k in range(len(prices)):
+        current = prices[k]
+        seeded = np.where(np.isnan(previous), current, ema_lambda * current + (1 - ema_lambda) * previous)
+        previous = np.where(np.isfinite(current), seeded, previous)
+        result[k] = previous
+    return result
+
+
+class Indicators:
+    """
+    Precomputed indicators of a price matrix, looked up by (timestamp index, ticker id).
+    """
+
+    def __init__(self, timestamps, tickers, values) -> None:
+        self._rows = {timestamp: k for k, timestamp in enumerate(timestamps)}
+        self._columns = {ticker: k for k, ticker in enumerate(tickers)}
+        self._values = values
+
+    def __contains__(self, item):
+        return item in self._values
+
+    def row(self, timestamp):
+        return self._rows[timestamp]
+
+    def column(self, ticker):
+        return self._columns[ticker]
+
+    def get(self, name, row, column):
+        return self._values[name][row, column]
+
+    def sma(self, window, row, column):
+        return self.get('sma_%d' % window, row, column)
+
+    def ema(self, row, column):
+        return self.get('ema', row, column)
+
+    def volatility(self, row, column):
+        return self.get('volatility', row, column)
+
+
+class IndicatorEngine:
+    """
+    Computes rolling indicators over a whole (timestamps x tickers) price matrix at once. When a cache directory is
+    given results are stored on disk as .npy files which are memory mapped on load so that concurrent runs share the
+    same pages, otherwise the most recent results are kept in memory. Entries are keyed by the dataset and the
+    indicator parameters.
+
+    Rolling windows are taken over the prices available for each ticker, matching the tick stream of the DataSource
+    which skips missing prices.
+    """
+    _memory = OrderedDict()
+    _memory_entries = 8  # Results kept in memory when there is no cache directory
+
+    def __init__(self, windows=(20,), ema_lambda=.5, volatility_window=20, cache_dir=None) -> None:
+        if len(windows) == 0 or min(windows) < 1:
+            raise ValueError("Windows must be Positive")
+        if volatility_window < 2:
+            raise ValueError("Volatility window must be at least 2")
+
+        self._windows = tuple(sorted(set(windows)))
+        self._lambda = ema_lambda
+        self._volatility_window = volatility_window
+        self._cache_dir = cache_dir
+
+    def key(self, timestamps, tickers, prices):
+        digest = hashlib.sha1()
+        digest.update(repr([str(timestamp) for timestamp in timestamps]).encode())
+        digest.update(repr([str(ticker) for ticker in tickers]).encode())
+        digest.update(np.ascontiguousarray(prices, dtype=float).tobytes())
+        digest.update(repr((self._windows, self._lambda, self._volatility_window)).encode())
+        return digest.hexdigest()
+
+    def compute(self, timestamps, tickers, prices) -> Indicators:
+        prices = np.asarray(prices, dtype=float)
+        if prices.shape != (len(timestamps), len(tickers)):
+            raise ValueError("Prices must be a (timestamps x tickers) matrix")
+
+        key = self.key(timestamps, tickers, prices)
+        if self._cache_dir is not None:
+            values = self._load(key)
+            if values is None:
+                self._store(key, self._calculate(prices))
+                values = self._load(key)
+        else:
+            values = IndicatorEngine._memory.pop(key, None)
+            if values is None:
+                values = self._calculate(prices)
+            IndicatorEngine._memory[key] = values
+            while len(IndicatorEngine._memory) > IndicatorEngine._memory_entries:
+                IndicatorEngine._memory.popitem(last=False)
+
+        return Indicators(timestamps, tickers, values)
+
+    def _calculate(self, prices):
+        values = {'sma_%d' % window: np.full(prices.shape, np.nan) for window in self._windows}
+        values['volatility'] = np.full(prices.shape, np.nan)
+        values['ema'] = exponential_mean(prices, self._lambda)
+
+        for column in range(prices.shape[1]):
+            valid = np.isfinite(prices[:, column])
+            history = prices[valid, column]
+            for window in self._windows:
+                values['sma_%d' % window][valid, column] = rolling_mean(history, window)
+
+            returns = np.full(len(history), np.nan)
+            returns[1:] = history[1:] / history[:-1] - 1
+            volatility = np.full(len(history), np.nan)
+            volatility[1:] = rolling_std(returns[1:], self._volatility_window)
+            values['volatility'][valid, column] = volatility
+
+        return values
+
+    def _load(self, key):
+        if self._cache_dir is None:
+            return None
+
+        path = os.path.join(self._cache_dir, key)
+        if not os.path.isdir(path):
+            return None
+
+        return {name[:-len('.npy')]: np.load(os.path.join(path, name), mmap_mode='r')
+                for name in os.listdir(path) if name.endswith('.npy')}
+
+    def _store(self, key, values):
+        if self._cache_dir is None:
+            return
+
+        os.makedirs(self._cache_dir, exist_ok=True)
+        staging = tempfile.mkdtemp(dir=self._cache_dir)
+        for name, value in values.items():
+            np.save(os.path.join(staging, name + '.npy'), value)
+        try:
+            # Renaming the whole directory makes the entry visible atomically to other runs
+            os.rename(staging, os.path.join(self._cache_dir, key))
+        except OSError:
+            shutil.rmtree(staging, ignore_errors=True)  # Another run stored the same entry first
@@ -0,0 +1,138 @@
+from array import array
+
+import numpy as np
+
+
+class LotLedger:
+    """
+    Tax lots of a single position kept in two contiguous arrays of doubles. Open lots live between the head index
+    and the end of the arrays, buys are appended at the end and sells are matched from the head (FIFO) or against a
+    specific lot. Consumed lots are compacted away once they make up half of the arrays, so matching is amortized
+    O(1) per lot.
+    """
+    __compact_after = 32  # Consumed lots kept before compacting
+
+    def __init__(self) -> None:
+        self._shares = array('d')
+        self._prices = array('d')
+        self._head = 0
+        self._offset = 0  # Lot id of the first slot in the arrays
+        self._total_shares = 0.
+        self._cost_basis = 0.
+        self._realized = 0.
+
+    def __len__(self) -> int:
+        return len(self._shares) - self._head
+
+    @property
+    def shares(self) -> float:
+        return self._total_shares
+
+    @property
+    def cost_basis(self) -> float:
+        return self._cost_basis
+
+    @property
+    def realized_pnl(self) -> float:
+        return self._realized
+
+    def unrealized_pnl(self, price: float) -> float:
+        return price * self._total_shares - self._cost_basis
+
+    def lots(self):
+        # Lot ids, shares and prices of the open lots
+        ids = np.arange(self._head, len(self._shares)) + self._offset
+        shares = np.array(self._shares[self._head:])
+        open_lots = shares > 1e-7
+        return ids[open_lots], shares[open_lots], np.array(self._prices[self._head:])[open_lots]
+
+    def buy(self, shares: float, price: float) -> int:
+        """
+        Opens a new lot and returns its id, which may be used to sell against this specific lot.
+        """
+        if shares <= 0:
+            raise ValueError("Shares bought must be Positive")
+
+        self._shares.append(shares)
+        self._prices.append(price)
+        self._total_shares += shares
+        self._cost_basis += shares * price
+
+        return len(self._shares) - 1 + self._offset
+
+    def sell(self, shares: float, price: float, lot: int = None) -> float:
+        """
+        Closes shares FIFO, or against the given lot id, and returns the realized P&L of the sale. Fees are not
+        part of the realized P&L.
+        """
+        if shares <= 0:
+            raise ValueError("Shares sold must be Positive")
+        total = self._total_shares
+        if shares > total + 1e-7:
+            raise ValueError("Can not sell more shares than the open lots hold")
+
+        if lot is not None:
+            matched, cost = self._close_lot(lot, shares)
+        else:
+            # FIFO sweep on plain floats, lots emptied by specific-lot sales are consumed at no cost
+            lot_shares = self._shares
+            lot_prices = self._prices
+            head = self._head
+            end = len(lot_shares)
+            remaining = min(shares, total)
+            matched = remaining
+            cost = 0.
+            while remaining > 1e-7 and head < end:
+                available = lot_shares[head]
+                if available <= remaining + 1e-7:
+                    cost += available * lot_prices[head]
+                    remaining -= available
+                    lot_shares[head] = 0.
+                    head += 1
+                else:
+                    cost += remaining * lot_prices[head]
+                    lot_shares[head] = available - remaining
+                    remaining = 0.
+            matched -= remaining
+            self._head = head
+
+        total -= matched
+        if total <= 1e-7:
+            # Avoids drift in the running totals once the position is flat
+            self.reset(0, 0)
+        else:
+            self._total_shares = total
+            self._cost_basis -= cost
+            if self._head >= LotLedger.__compact_after and 2 * self._head >= len(self._shares):
+                del self._shares[:self._head]
+                del self._prices[:self._head]
+                self._offset += self._head
+                self._head = 0
+
+        realized = matched * price - cost
+        self._realized += realized
+        return realized
+
+    def reset(self, shares: float, price: float) -> None:
+        # Replaces every open lot with a single opening lot, realized P&L is kept
+        self._offset += len(self._shares)
+        del self._shares[:]
+        del self._prices[:]
+        self._head = 0
+        self._total_shares = 0.
+        self._cost_basis = 0.
+        if shares > 1e-7:
+            self.buy(shares, price)
+
+    def _close_lot(self, lot, shares):
+        index = lot - self._offset
+        if index < self._head or index >= len(self._shares) or self._shares[index] <= 1e-7:
+            raise ValueError("Lot %s is not open" % lot)
+        if shares > self._shares[index] + 1e-7:
+            raise ValueError("Can not sell more shares than lot %s holds" % lot)
+
+        shares = min(shares, self._shares[index])
+        self._shares[index] -= shares
+        while self._head < len(self._shares) and self._shares[self._head] <= 1e-7:
+            self._head += 1
+        return shares, shares * self._prices[index]
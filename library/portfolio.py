@@ -1,8 +1,9 @@
+from library.ledger import LotLedger
 from library.order import Transaction
 
 
 class Position:
-    def __init__(self, stock: str, price: float, shares: float = 0) -> None:
+    def __init__(self, stock: str, price: float, shares: float = 0, lots: bool = True) -> None:
         if stock is None:
             raise ValueError("Stock ticker must not be None")
         if price <= 0:
@@ -13,6 +14,9 @@ class Position:
         self._shares = shares
         self._cost_per_share = price
         self._updates = 0
+        self._lots = LotLedger() if lots else None  # Cash does not need a lot ledger
+        if lots and shares > 0:
+            self._lots.buy(shares, price)
 
     @property
     def stock(self) -> str:
@@ -25,6 +29,8 @@ class Position:
     @shares.setter
     def shares(self, shares: float) -> None:
         self._shares = shares
+        if self._lots is not None:
+            self._lots.reset(shares, self.cost_per_share)
 
     @property
     def price(self) -> float:
@@ -39,8 +45,20 @@ class Position:
 
     @property
     def cost_per_share(self) -> float:
+        # Cost of the open lots, the last known cost is kept once the position is flat
+        lots = self._lots
+        if lots is not None and lots.shares > 1e-7:
+            return lots.cost_basis / lots.shares
         return self._cost_per_share
 
+    @property
+    def realized_pnl(self) -> float:
+        return self._lots.realized_pnl if self._lots is not None else 0
+
+    @property
+    def unrealized_pnl(self) -> float:
+        return self._lots.unrealized_pnl(self._price) if self._lots is not None else 0
+
     @property
     def updates(self) -> int:
         return self._updates
@@ -49,28 +67,33 @@ class Position:
     def updates(self, updates: int) -> None:
         self._updates = updates
 
-    def add_transaction(self, txn: Transaction) -> None:
+    def add_transaction(self, txn: Transaction, lot: int = None) -> None:
+        """
+        Applies the transaction to the lot ledger. Sells are matched FIFO unless a specific lot id is given,
+        the cost per share reflects the lots which remain open.
+        """
         if self._stock != txn.stock:
             raise ValueError("Transaction stock ticker must be the same as position ticker")
 
-        if self._shares + txn.shares < 0:
+        shares = txn.shares
+        price = txn.price
+        if self._shares + shares < 0:
             raise ValueError("Transaction can not sell more shares than current position")
 
-        if txn.is_buy():
-            total_cost = self._cost_per_share * self._shares + txn.price * txn.shares
-            self._shares += txn.shares
-            if self._shares > 1e-7:
-                # for liquidate, don't need update cost per share
-                self._cost_per_share = total_cost / self._shares
+        if shares > 0:
+            self._lots.buy(shares, price)
         else:
-            # Future improvement includes using FIFO here
-            self._shares += txn.shares
+            if self._shares + shares <= 1e-7:
+                # for liquidate, keep the cost per share of the closed lots
+                self._cost_per_share = self.cost_per_share
+            self._lots.sell(-shares, price, lot=lot)
+        self._shares += shares
 
-        self._price = txn.price
+        self._price = price
 
     def get_gain_or_loss(self) -> float:
         if self._shares > 0:
-            return self._price / self._cost_per_share - 1
+            return self._price / self.cost_per_share - 1
         return 0
 
 
@@ -85,7 +108,7 @@ class Portfolio:
         if balance < 0:
             raise ValueError("Balance value must not be Negative")
 
-        self._portfolio = {Portfolio.__cash: Position(Portfolio.__cash, 1.0, balance)}
+        self._portfolio = {Portfolio.__cash: Position(Portfolio.__cash, 1.0, balance, lots=False)}
 
     def update(self, price, ticker):
         if ticker in self._portfolio:
@@ -123,6 +146,9 @@ class Portfolio:
     def get_value(self, ticker):
         return self.get_shares(ticker) * self.get_shares(ticker)
 
+    def get_tickers(self):
+        return [ticker for ticker in self._portfolio if ticker != Portfolio.__cash]
+
     def get_price(self, ticker):
         return self._portfolio[ticker].price
 
@@ -132,6 +158,12 @@ class Portfolio:
     def get_update_count(self, ticker):
         return self._portfolio[ticker].updates
 
+    def get_realized_pnl(self, ticker):
+        return self._portfolio[ticker].realized_pnl
+
+    def get_unrealized_pnl(self, ticker):
+        return self._portfolio[ticker].unrealized_pnl
+
     def set_shares(self, ticker, shares):  # TODO: retire set_shares
         self._portfolio[ticker].shares = shares
 
@@ -140,5 +172,13 @@ class Portfolio:
         self._portfolio[txn.stock].add_transaction(txn)
         self._portfolio[Portfolio.__cash].shares = self.cash - (txn.price * txn.shares + txn.fee)
 
+    def update_trades(self, txns):
+        # Bulk version of update_trade, cash is settled once for the whole batch
+        cash_delta = 0
+        for txn in txns:
+            self._portfolio[txn.stock].add_transaction(txn)
+            cash_delta -= txn.price * txn.shares + txn.fee
+        self._portfolio[Portfolio.__cash].shares = self.cash + cash_delta
+
     def __str__(self):
         return self._portfolio.__str__()
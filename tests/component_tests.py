@@ -1,10 +1,38 @@
+import contextlib
 import datetime
+import io
+import os
+import subprocess
+import sys
+import tempfile
 import unittest
+import warnings
 from multiprocessing import Queue
 
+import numpy as np
+
+from library.algorithm import Algorithm
+from library.indicators import IndicatorEngine
+from library.ledger import LotLedger
 from library.order import Order
+from library.order import Transaction
 from library.portfolio import Portfolio
 from training.backtester import Controller
+from training.catalog import ResultsCatalog
+from training.datasource import bar_offsets
+from training.metrics import equity_metrics
+from training.search import SuccessiveHalving
+from training.walkforward import WalkForward
+
+IMPORT_BUDGET = 1.0  # Seconds allowed to import the engine in a fresh interpreter, as done by spawned workers
+
+
+def make_history(bars, tickers=('TICK', 'TOCK'), seed=0):
+    rng = np.random.default_rng(seed)
+    prices = 100 * np.exp(np.cumsum(rng.normal(0, .03, size=(bars, len(tickers))), axis=0))
+    start = datetime.datetime(2020, 1, 1)
+    return [(start + datetime.timedelta(days=k), ticker, prices[k, column])
+            for k in range(bars) for column, ticker in enumerate(tickers)]
 
 
 class ComponentTests(unittest.TestCase):
@@ -29,6 +57,22 @@ class ComponentTests(unittest.TestCase):
         self.assertAlmostEqual(p.get_total_value(), 10. + 3. * 12., delta=1e-7)
         self.assertAlmostEqual(p.get_price('TICK'), 12., delta=1e-7)
 
+    def test_stream_failure(self):
+        class FailingAlgorithm(Algorithm):
+            def generate_orders(self, timestamp, portfolio):
+                raise RuntimeError('Algorithm failed')
+
+        q = Queue()
+        q.put(('2020-01-01', 'TICK', 10.0))
+        q.put('POISON')
+        results = Queue()
+
+        c = Controller(portfolio=Portfolio(balance=10.0), algorithm=FailingAlgorithm())
+        with contextlib.redirect_stdout(io.StringIO()):
+            Controller.backtest(q, controller=c, results=results)
+
+        self.assertIsNone(results.get(timeout=5))  # Failed runs are marked so they are not cached
+
     def test_update(self):
         p = Portfolio(balance=10.0)
         p.update(ticker='TICK', price=10.0)
@@ -87,6 +131,274 @@ class ComponentTests(unittest.TestCase):
         self.assertTrue(abs(0.0 - p.get_shares('TICK')) < eps)  # Shares updated
         self.assertTrue(abs(11.0 - p.get_price('TICK')) < eps)  # Price should reflect the latest update
 
+    def test_batch_netting(self):
+        p = Portfolio(balance=100.0)
+        p.update(ticker='TICK', price=10.0)
+        p.update(ticker='TOCK', price=5.0)
+        p.set_shares('TOCK', 4.0)
+        cont = Controller(p)
+        txns = cont.process_orders([Order('TICK', 10.0, 3.0), Order('TOCK', 5.0, -6.0), Order('TICK', 10.0, -1.0)])
+        eps = 1e-7
+
+        fees = cont._order_api.calculate_fee(Order('TICK', 10.0, 2.0)) + \
+            cont._order_api.calculate_fee(Order('TOCK', 5.0, 4.0))
+
+        self.assertEqual(2, len(txns))  # One transaction per ticker
+        self.assertTrue(abs(2.0 - p.get_shares('TICK')) < eps)  # Buys and sells netted
+        self.assertTrue(abs(0.0 - p.get_shares('TOCK')) < eps)  # Sell clipped to holdings
+        self.assertTrue(abs(100.0 - 20.0 + 20.0 - fees - p.cash) < eps)  # Cash settled for the batch
+
+    def test_batch_failures(self):
+        p = Portfolio(balance=100.0)
+        p.update(ticker='TICK', price=10.0)
+        p.update(ticker='TOCK', price=5.0)
+        cont = Controller(p)
+        with contextlib.redirect_stdout(io.StringIO()) as output:
+            txns = cont.process_orders([Order('TICK', 12.0, -1.0), Order('TUCK', 1.0, 1.0), Order('TOCK', 5.0, -1.0)])
+
+        self.assertEqual(0, len(txns))
+        self.assertTrue(abs(100.0 - p.cash) < 1e-7)  # Nothing booked
+        self.assertIn('Sell failed: TICK at $12.0 for -1.0 shares', output.getvalue())  # Submitted order is logged
+        self.assertIn('Buy failed: TUCK', output.getvalue())  # Unknown ticker
+        self.assertIn('Sell failed: TOCK', output.getvalue())  # Nothing to sell
+
+        # Quiet controllers only log
+        with self.assertLogs('training.controller', level='INFO') as logs, \
+                contextlib.redirect_stdout(io.StringIO()) as output:
+            Controller(p, quiet=True).process_orders([Order('TUCK', 1.0, 1.0)])
+        self.assertEqual('', output.getvalue())
+        self.assertIn('Buy failed: TUCK', logs.output[0])
+
+        # No buys and no cash does not scale the empty batch
+        p = Portfolio(balance=0.)
+        p.update(ticker='TICK', price=10.0)
+        with warnings.catch_warnings(), contextlib.redirect_stdout(io.StringIO()):
+            warnings.simplefilter('error')
+            self.assertEqual([], Controller(p).process_orders([Order('TICK', 10.0, -1.0)]))
+
+    def test_batch_prices(self):
+        p = Portfolio(balance=100.0)
+        p.update(ticker='TICK', price=10.0)
+        p.set_shares('TICK', 3.0)
+        cont = Controller(p)
+        with contextlib.redirect_stdout(io.StringIO()):
+            txns = cont.process_orders([Order('TICK', 10.0, 1.0), Order('TICK', 10.01, 1.0),
+                                        Order('TICK', 11.0, -2.0), Order('TICK', 12.0, -2.0)])
+
+        self.assertEqual([(10.0, 1.0), (10.01, 1.0), (11.0, -2.0), (12.0, -1.0)],
+                         [(txn.price, txn.shares) for txn in txns])  # One transaction per ticker and price
+        self.assertTrue(abs(2.0 - p.get_shares('TICK')) < 1e-7)  # Sells clipped to the 3 shares held
+
+    def test_batch_scaling(self):
+        p = Portfolio(balance=100.0)
+        p.update(ticker='TICK', price=10.0)
+        p.update(ticker='TOCK', price=10.0)
+        cont = Controller(p)
+        orders = [Order('TICK', 10.0, 10.0), Order('TOCK', 10.0, 10.0)]
+        cont.process_orders(orders)
+
+        q = Portfolio(balance=100.0)
+        q.update(ticker='TICK', price=10.0)
+        q.update(ticker='TOCK', price=10.0)
+        Controller(q).process_orders(orders[::-1])
+
+        self.assertTrue(p.cash > 0)  # Buys scaled down to the cash headroom
+        self.assertAlmostEqual(p.get_shares('TICK'), p.get_shares('TOCK'), delta=1e-7)  # Scaled evenly
+        self.assertAlmostEqual(p.cash, q.cash, delta=1e-7)  # Independent of the order of the list
+
+    def test_fifo_lots(self):
+        p = Portfolio(balance=100.0)
+        p.update(ticker='TICK', price=10.0)
+        p.update_trade(Transaction('TICK', 10.0, 2.0, 0.0))
+        p.update_trade(Transaction('TICK', 12.0, 2.0, 0.0))
+        p.update_trade(Transaction('TICK', 15.0, -3.0, 0.0))
+        eps = 1e-7
+
+        self.assertTrue(abs(2 * 5.0 + 3.0 - p.get_realized_pnl('TICK')) < eps)  # Oldest lots matched first
+        self.assertTrue(abs(3.0 - p.get_unrealized_pnl('TICK')) < eps)  # One share left from the 12.0 lot
+        self.assertTrue(abs(0.25 - p._portfolio['TICK'].get_gain_or_loss()) < eps)  # Cost of the open lot
+
+    def test_specific_lot(self):
+        ledger = LotLedger()
+        first = ledger.buy(2.0, 10.0)
+        second = ledger.buy(2.0, 12.0)
+        ledger.sell(2.0, 15.0, lot=second)
+        ledger.sell(1.0, 15.0)
+        eps = 1e-7
+
+        self.assertEqual(1, len(ledger.lots()[0]))  # Only the first lot is still open
+        self.assertEqual(first, ledger.lots()[0][0])
+        self.assertTrue(abs(2 * 3.0 + 5.0 - ledger.realized_pnl) < eps)  # Specific lot, then FIFO
+        self.assertTrue(abs(10.0 - ledger.cost_basis) < eps)
+        self.assertRaises(ValueError, ledger.sell, 1.0, 15.0, second)  # Closed lots can not be sold again
+
+    def test_lot_compaction(self):
+        ledger = LotLedger()
+        ids = [ledger.buy(1.0, float(k + 1)) for k in range(100)]
+        for k in range(70):
+            ledger.sell(1.0, 200.0)
+        ledger.sell(1.0, 200.0, lot=ids[90])
+        eps = 1e-7
+
+        self.assertEqual(ids[70:90] + ids[91:], list(ledger.lots()[0]))  # Lot ids survive compaction
+        self.assertTrue(abs(sum(range(71, 101)) - 91 - ledger.cost_basis) < eps)
+        self.assertTrue(abs(70 * 200.0 - sum(range(1, 71)) + 200.0 - 91 - ledger.realized_pnl) < eps)
+
+    def test_indicator_lookup(self):
+        prices = 10 + np.cumsum(np.random.default_rng(0).normal(0, .1, size=(40, 2)), axis=0)
+        prices[5, 1] = np.nan
+        timestamps = list(range(40))
+        tickers = ['TICK', 'TOCK']
+        cached = Algorithm()
+        cached.set_indicators(IndicatorEngine(**cached.indicator_parameters()).compute(timestamps, tickers, prices))
+        streamed = Algorithm()
+
+        for timestamp in timestamps:
+            for column, ticker in enumerate(tickers):
+                if np.isfinite(prices[timestamp, column]):
+                    cached.update(ticker, prices[timestamp, column], timestamp)
+                    streamed.update(ticker, prices[timestamp, column])
+                    if timestamp >= 25:
+                        self.assertAlmostEqual(streamed.get_window_average(ticker), cached.get_window_average(ticker),
+                                               delta=1e-7)  # Same window as the tick by tick history
+                        self.assertAlmostEqual(streamed.get_price(ticker), cached.get_price(ticker), delta=1e-7)
+
+    def test_indicator_cache(self):
+        prices = 10 + np.cumsum(np.random.default_rng(1).normal(0, .1, size=(30, 3)), axis=0)
+        with tempfile.TemporaryDirectory() as cache_dir:
+            engine = IndicatorEngine(windows=(5, 10), ema_lambda=.3, volatility_window=5, cache_dir=cache_dir)
+            loaded = engine.compute(range(30), ['A', 'B', 'C'], prices)
+            computed = IndicatorEngine(windows=(5, 10), ema_lambda=.3, volatility_window=5).compute(
+                range(30), ['A', 'B', 'C'], prices)
+
+            self.assertTrue(isinstance(loaded._values['ema'], np.memmap))  # Served from the disk cache
+            for name in ('sma_5', 'sma_10', 'ema', 'volatility'):
+                np.testing.assert_allclose(computed._values[name], loaded._values[name])
+            self.assertAlmostEqual(np.std(prices[25:, 2] / prices[24:-1, 2] - 1, ddof=1), loaded.volatility(29, 2),
+                                   delta=1e-7)
+
+        for window in range(2, 20):
+            IndicatorEngine(windows=(window,)).compute(range(30), ['A', 'B', 'C'], prices)
+        self.assertEqual(IndicatorEngine._memory_entries, len(IndicatorEngine._memory))  # Memory cache is bounded
+
+    def test_import_budget(self):
+        script = 'import sys, time; start = time.perf_counter(); import training.backtester; ' \
+                 'print(time.perf_counter() - start, "pandas" in sys.modules)'
+        root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        output = subprocess.run([sys.executable, '-c', script], cwd=root, capture_output=True, text=True, check=True)
+        elapsed, pandas_loaded = output.stdout.split()
+
+        self.assertEqual('False', pandas_loaded)  # Data adapters are loaded lazily
+        self.assertLess(float(elapsed), IMPORT_BUDGET)
+
+        # POSIX only modules are not needed to import the engine
+        script = 'import sys; sys.modules["fcntl"] = None; import training.backtester'
+        subprocess.run([sys.executable, '-c', script], cwd=root, capture_output=True, check=True)
+
+    def test_results_catalog(self):
+        p = Portfolio(balance=100.0)
+        p.update(ticker='TICK', price=10.0)
+        cont = Controller(p)
+        cont.process_tick(timestamp='2020-01-01', ticker='TICK', price=10.0)
+        cont.process_orders([Order('TICK', 10.0, 2.0)])
+        cont.process_tick(timestamp='2020-01-02', ticker='TICK', price=11.0)
+        result = cont.results()
+
+        with tempfile.TemporaryDirectory() as path:
+            catalog = ResultsCatalog(path, max_entries=2)
+            key = ResultsCatalog.key(Algorithm(), Portfolio(100.0))
+            catalog.put(key, result)
+            cached = catalog.get(key)
+
+            self.assertEqual(key, ResultsCatalog.key(Algorithm(), Portfolio(100.0)))  # Stable across instances
+            self.assertNotEqual(key, ResultsCatalog.key(Algorithm(), Portfolio(101.0)))
+            self.assertAlmostEqual(result['value'], cached['value'], delta=1e-7)
+            self.assertEqual({'TICK': 2.0}, cached['positions'])
+            np.testing.assert_allclose(result['equity_values'], cached['equity_values'])
+            self.assertEqual(['2020-01-01', '2020-01-02'], list(cached['equity_timestamps']))
+            self.assertEqual(['TICK'], list(cached['trade_tickers']))
+
+            catalog.put('second', result)
+            catalog.get(key)
+            catalog.put('third', result)
+            self.assertEqual(2, len(catalog))  # Least recently used entry evicted
+            self.assertTrue(key in catalog)
+            self.assertFalse('second' in catalog)
+
+            # Entries left out of the index by an interrupted writer are evicted first
+            with open(os.path.join(path, 'orphan.npz'), 'wb') as f:
+                f.write(b'0')
+            catalog.put('fourth', result)
+            self.assertFalse(os.path.exists(os.path.join(path, 'orphan.npz')))
+            self.assertEqual({'fourth', 'third', 'index.json', 'index.lock'},
+                             {name[:-len('.npz')] if name.endswith('.npz') else name for name in os.listdir(path)})
+
+    def test_successive_halving(self):
+        history = make_history(120)
+        configurations = [{'price_window': window, 'minimum_wait_between_trades': 2}
+                          for window in (5, 8, 10, 15, 20, 30)]
+        search = SuccessiveHalving(history, configurations, budget=400, eta=2, workers=2)
+        counts, horizons = search.schedule()
+        results = search.run()
+
+        self.assertEqual([6, 3, 1], counts)
+        self.assertLessEqual(sum(count * (horizon - previous)
+                                 for count, horizon, previous in zip(counts, horizons, [0] + horizons)), 400)
+        self.assertEqual(6, len(results))
+        self.assertEqual(2, results[0]['rung'])  # Winner reached the last rung
+        self.assertEqual(horizons[-1], results[0]['bars'])
+
+        # Resuming across rungs matches a single uninterrupted run
+        controller = Controller(portfolio=Portfolio(10000), algorithm=Algorithm(**results[0]['parameters']))
+        with contextlib.redirect_stdout(io.StringIO()):
+            for timestamp, ticker, price in history[:bar_offsets(history)[horizons[-1]]]:
+                controller.process_tick(timestamp=timestamp, ticker=ticker, price=price)
+        self.assertAlmostEqual(controller.results()['equity_values'][-1], results[0]['value'], delta=1e-7)
+
+        # Small budgets drop rungs which add no bars and tiny ones are rejected
+        counts, horizons = SuccessiveHalving(history, configurations, budget=10, eta=2).schedule()
+        self.assertEqual(([6, 1], [1, 3]), (counts, horizons))
+        with self.assertRaises(ValueError):
+            SuccessiveHalving(history, configurations, budget=3, eta=2).schedule()
+        with self.assertLogs('training.search', level='WARNING'), contextlib.redirect_stdout(io.StringIO()):
+            SuccessiveHalving(history, configurations, budget=10, eta=2, workers=1).run()  # Windows longer than 1 bar
+
+        # Both drivers score an untraded run at the starting balance
+        self.assertEqual({'value': 100., 'return': 0., 'sharpe': 0., 'drawdown': 0.}, equity_metrics([], 100.))
+
+    def test_walk_forward(self):
+        history = make_history(100)
+        candidates = [{'price_window': 8, 'minimum_wait_between_trades': 2}, {'price_window': 12}]
+        walk_forward = WalkForward(history, train_bars=40, test_bars=20, candidates=candidates, workers=2)
+        report = walk_forward.run()
+        serial = WalkForward(history, train_bars=40, test_bars=20, candidates=candidates, workers=1)
+        with contextlib.redirect_stdout(io.StringIO()):
+            serial_report = serial.run()
+
+        self.assertEqual([(0, 40, 60), (20, 60, 80), (40, 80, 100)], walk_forward.folds())
+        self.assertEqual(3, report.summary()['folds'])
+        for fold, serial_fold in zip(report.folds, serial_report.folds):
+            self.assertEqual(fold['parameters'], serial_fold['parameters'])
+            self.assertAlmostEqual(fold['test']['value'], serial_fold['test']['value'], delta=1e-7)
+
+        # Warm state matches replaying the whole prefix before the test window
+        best = report.folds[-1]['parameters']
+        controller = Controller(portfolio=Portfolio(10000), algorithm=Algorithm(**best))
+        offsets = bar_offsets(history)
+        with contextlib.redirect_stdout(io.StringIO()):
+            for timestamp, ticker, price in history[:offsets[80]]:
+                controller.process_pricing(ticker=ticker, price=price, timestamp=timestamp)
+            for timestamp, ticker, price in history[offsets[80]:]:
+                controller.process_tick(timestamp=timestamp, ticker=ticker, price=price)
+        self.assertAlmostEqual(controller.results()['value'], report.folds[-1]['test']['value'], delta=1e-7)
+
+    def test_algorithm_parameters(self):
+        algorithm = Algorithm(price_window=8, ema_lambda=.3, minimum_wait_between_trades=2)
+        copy = Algorithm(**algorithm.parameters())
+
+        self.assertEqual({'price_window': 8, 'ema_lambda': .3, 'minimum_wait_between_trades': 2}, copy.parameters())
+        self.assertEqual(algorithm.indicator_parameters(), copy.indicator_parameters())
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,171 @@
+import contextlib
+import hashlib
+import json
+import logging
+import os
+import tempfile
+
+import numpy as np
+
+from library.indicators import Indicators
+
+
+def fingerprint(obj, digest=None):
+    """
+    Feeds a stable description of the object into the digest and returns it. Objects are described by their class
+    and attributes, loggers and precomputed indicators are skipped as they do not change the outcome of a run.
+    """
+    digest = hashlib.sha1() if digest is None else digest
+
+    if obj is None or isinstance(obj, (bool, int, float, str, np.generic)):
+        digest.update(('%s:%r;' % (type(obj).__name__, obj.item() if isinstance(obj, np.generic) else obj)).encode())
+    elif hasattr(obj, 'isoformat'):
+        digest.update(('date:%s;' % obj.isoformat()).encode())
+    elif isinstance(obj, np.ndarray):
+        digest.update(('array:%s:%s;' % (obj.dtype, obj.shape)).encode())
+        digest.update(np.ascontiguousarray(obj).tobytes())
+    elif isinstance(obj, dict):
+        digest.update(b'dict;')
+        for key in sorted(obj, key=repr):
+            fingerprint(key, digest)
+            fingerprint(obj[key], digest)
+    elif isinstance(obj, (list, tuple)):
+        digest.update(('%s:%d;' % (type(obj).__name__, len(obj))).encode())
+        for item in obj:
+            fingerprint(item, digest)
+    elif hasattr(obj, '__dict__'):
+        digest.update(('object:%s;' % type(obj).__qualname__).encode())
+        fingerprint({key: value for key, value in vars(obj).items()
+                     if not isinstance(value, (logging.Logger, Indicators))}, digest)
+    else:
+        digest.update(('%s:%s;' % (type(obj).__name__, obj)).encode())
+
+    return digest
+
+
+class ResultsCatalog:
+    """
+    On-disk catalog of backtest results keyed by a hash of the run configuration. Each result is stored as a
+    compressed .npz file and an index keeps the size and last access of every entry, so the least recently used
+    entries are evicted once the catalog holds more than max_entries results or max_bytes on disk.
+
+    Several processes may share a catalog: index updates are serialized with a lock file and files are written under
+    unique temporary names before being moved into place. Runs with simulated slippage or order failures are cached
+    with the draw of their first run.
+    """
+    __index = 'index.json'
+    __lock = 'index.lock'
+
+    def __init__(self, path, max_entries=256, max_bytes=256 * 1024 * 1024) -> None:
+        if max_entries < 1 or max_bytes < 1:
+            raise ValueError("Catalog limits must be Positive")
+
+        self._path = path
+        self._max_entries = max_entries
+        self._max_bytes = max_bytes
+        self._logger = logging.getLogger(__name__)
+        os.makedirs(path, exist_ok=True)
+
+    @staticmethod
+    def key(*parts):
+        return fingerprint(parts).hexdigest()
+
+    def __contains__(self, key):
+        return key in self._read_index()['entries']
+
+    def __len__(self):
+        return len(self._read_index()['entries'])
+
+    def get(self, key):
+        index = self._read_index()
+        if key not in index['entries']:
+            return None
+
+        try:
+            with np.load(self._entry_path(key)) as data:
+                result = {name: data[name] for name in data.files if name != 'state'}
+                state = json.loads(str(data['state']))
+        except (OSError, ValueError) as e:
+            self._logger.error(e)
+            return None
+
+        with self._locked():
+            index = self._read_index()
+            if key in index['entries']:
+                index['clock'] += 1
+                index['entries'][key]['access'] = index['clock']
+                self._write_index(index)
+
+        result.update(state)
+        return result
+
+    def put(self, key, result):
+        arrays = {name: value for name, value in result.items() if isinstance(value, np.ndarray)}
+        state = {name: value for name, value in result.items() if not isinstance(value, np.ndarray)}
+
+        handle, temp = tempfile.mkstemp(dir=self._path, suffix='.tmp')
+        with os.fdopen(handle, 'wb') as f:
+            np.savez_compressed(f, state=np.array(json.dumps(state)), **arrays)
+
+        with self._locked():
+            os.replace(temp, self._entry_path(key))
+            index = self._read_index()
+            index['clock'] += 1
+            index['entries'][key] = {'size': os.path.getsize(self._entry_path(key)), 'access': index['clock']}
+            self._evict(index)
+            self._write_index(index)
+
+    @contextlib.contextmanager
+    def _locked(self):
+        # Platform locks are imported here so that importing the catalog, and the engine, works everywhere
+        with open(os.path.join(self._path, ResultsCatalog.__lock), 'a+') as f:
+            try:
+                import fcntl
+            except ImportError:
+                import msvcrt
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+                try:
+                    yield
+                finally:
+                    f.seek(0)
+                    msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+            else:
+                fcntl.flock(f, fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _evict(self, index):
+        entries = index['entries']
+        for name in os.listdir(self._path):
+            # Entries missing from the index, e.g. left by an interrupted writer, are evicted first
+            key = name[:-len('.npz')]
+            if name.endswith('.npz') and key not in entries:
+                entries[key] = {'size': os.path.getsize(self._entry_path(key)), 'access': 0}
+
+        while len(entries) > 1 and (len(entries) > self._max_entries or
+                                    sum(entry['size'] for entry in entries.values()) > self._max_bytes):
+            oldest = min(entries, key=lambda k: entries[k]['access'])
+            del entries[oldest]
+            try:
+                os.remove(self._entry_path(oldest))
+            except OSError:
+                pass
+
+    def _entry_path(self, key):
+        return os.path.join(self._path, key + '.npz')
+
+    def _read_index(self):
+        try:
+            with open(os.path.join(self._path, ResultsCatalog.__index)) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {'clock': 0, 'entries': {}}
+
+    def _write_index(self, index):
+        handle, temp = tempfile.mkstemp(dir=self._path, suffix='.tmp')
+        with os.fdopen(handle, 'w') as f:
+            json.dump(index, f)
+        os.replace(temp, os.path.join(self._path, ResultsCatalog.__index))
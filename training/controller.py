@@ -0,0 +1,282 @@
+import logging
+
+import numpy as np
+
+from library.algorithm import Algorithm
+from library.order import Order
+from library.order import Transaction
+from library.portfolio import Portfolio
+
+
+class OrderApi:
+    def __init__(self):
+        self._slippage_std = .01
+        self._prob_of_failure = .0001
+        self._fee_per_share = .005
+        self._fixed_fee = 0
+        self._allow_order_fail = False
+        self._allow_volatile = False
+
+    def process_order(self, order: Order):
+        # Simulate the price volatility
+        slippage = np.random.normal(0, self._slippage_std, size=1)[0] if self._allow_volatile else 0.
+
+        # Simulate the order processing so that it may fail
+        if (np.random.choice([False, True], p=[self._prob_of_failure, 1 - self._prob_of_failure], size=1)[0]) \
+                or not self._allow_order_fail:
+            return order.stock, order.price * (1 + slippage), order.shares, self.calculate_fee(order)
+
+    def process_orders(self, prices, shares):
+        """
+        Vectorized version of process_order. Takes arrays of prices and shares and returns the filled prices,
+        shares and fees together with a boolean mask of the orders which went through.
+        """
+        prices = np.asarray(prices, dtype=float)
+        shares = np.asarray(shares, dtype=float)
+
+        # Simulate the price volatility
+        slippage = np.random.normal(0, self._slippage_std, size=len(prices)) if self._allow_volatile \
+            else np.zeros(len(prices))
+
+        # Simulate the order processing so that it may fail
+        filled = np.random.random_sample(len(prices)) >= self._prob_of_failure if self._allow_order_fail \
+            else np.ones(len(prices), dtype=bool)
+
+        return prices * (1 + slippage), shares, self.calculate_fees(shares), filled
+
+    def calculate_fee(self, order: Order) -> float:
+        return self._fee_per_share * abs(order.shares) + self._fixed_fee
+
+    def calculate_fees(self, shares):
+        return self._fee_per_share * np.abs(shares) + self._fixed_fee
+
+
+class Controller:
+    def __init__(self, portfolio: Portfolio, algorithm=None, order_api=None, quiet=False):
+        self._logger = logging.getLogger(__name__)
+
+        if portfolio is None:
+            raise ValueError("Portfolio must be initialized")
+
+        self._portfolio = portfolio
+        self._algorithm = Algorithm() if algorithm is None else algorithm
+        self._order_api = OrderApi() if order_api is None else order_api
+        self._timestamp = None
+        self._equity = []  # (timestamp, total value) at the end of each timestamp
+        self._trades = []  # (timestamp, ticker, price, shares, fee) of each executed transaction
+        self._quiet = quiet  # Messages only go to the logger, e.g. in pool workers
+
+    @classmethod
+    def backtest(cls, queue, controller=None, results=None):
+        """
+        Runs the controller on the data streamed through the queue. When a results queue is given,
+        the outcome of the run is put on it once the stream ends, or None if the run failed.
+        """
+        controller = cls() if controller is None else controller
+        completed = False
+        try:
+            while True:
+                if not queue.empty():
+                    o = queue.get()
+                    # controller._logger.debug(o)
+
+                    if o == 'POISON':
+                        completed = True
+                        break
+
+                    controller.process_tick(timestamp=o[0], ticker=o[1], price=o[2])
+
+        except Exception as e:
+            controller._print(e)
+        finally:
+            controller._logger.info(controller._portfolio.value_summary(None))
+            controller._print(controller._portfolio.value_summary(None))
+            if results is not None:
+                results.put(controller.results() if completed else None)
+
+    def process_tick(self, timestamp, ticker, price):
+        self._timestamp = timestamp
+
+        # Update pricing
+        self.process_pricing(ticker=ticker, price=price, timestamp=timestamp)
+
+        # Generate Orders
+        orders = self._algorithm.generate_orders(timestamp, self._portfolio)
+
+        # Process orders
+        if len(orders) > 0:
+            self.process_orders(orders)
+
+            self._logger.info(self._portfolio.value_summary(timestamp))
+            self._print(self._portfolio.value_summary(timestamp))
+
+        # Keep one equity point per timestamp
+        if len(self._equity) > 0 and self._equity[-1][0] == timestamp:
+            self._equity[-1] = (timestamp, self._portfolio.get_total_value())
+        else:
+            self._equity.append((timestamp, self._portfolio.get_total_value()))
+
+    def results(self):
+        """
+        Final state, equity curve and trade list of the run. Timestamps are converted to strings
+        so the results may be stored and compared across runs.
+        """
+        trades = list(zip(*self._trades)) if len(self._trades) > 0 else [[]] * 5
+        return {
+            'value': self._portfolio.get_total_value(),
+            'cash': self._portfolio.cash,
+            'positions': {ticker: self._portfolio.get_shares(ticker) for ticker in self._portfolio.get_tickers()},
+            'equity_timestamps': np.array([str(timestamp) for timestamp, _ in self._equity], dtype=str),
+            'equity_values': np.array([value for _, value in self._equity], dtype=float),
+            'trade_timestamps': np.array([str(timestamp) for timestamp in trades[0]], dtype=str),
+            'trade_tickers': np.array(trades[1], dtype=str),
+            'trade_prices': np.array(trades[2], dtype=float),
+            'trade_shares': np.array(trades[3], dtype=float),
+            'trade_fees': np.array(trades[4], dtype=float),
+        }
+
+    def process_order(self, order):
+        success = False
+        receipt = self._order_api.process_order(order)
+        if receipt is not None:
+            success = self.process_receipt(receipt)
+
+        if order is None:
+            self._logger.info(('{order_type} failed: %s' % order).format(
+                order_type='Sell' if order is not None and order.shares < 0 else 'Buy'))
+            self._print(('{order_type} failed: %s' % order).format(
+                order_type='Sell' if order is not None and order.shares < 0 else 'Buy'))
+        elif success is False:
+            self._logger.info(
+                ('{order_type} failed: %s at $%s for %s shares' % (order.stock, order.price, order.shares)).format(
+                    order_type='Sell' if order is not None and order.shares < 0 else 'Buy'))
+            self._print(
+                ('{order_type} failed: %s at $%s for %s shares' % (order.stock, order.price, order.shares)).format(
+                    order_type='Sell' if order is not None and order.shares < 0 else 'Buy'))
+
+    def process_orders(self, orders):
+        """
+        Executes a list of orders as one batch. Orders are netted per ticker and price first, giving one
+        transaction per group, sells are clipped to the shares held and the cash headroom is checked for the whole
+        batch at once, so the outcome does not depend on the order of the list. If the buys cannot be covered they
+        are scaled down together to whole shares. Returns the list of executed transactions.
+        """
+        orders = [order for order in orders if order is not None]
+        if len(orders) == 0:
+            return []
+
+        stocks = np.array([order.stock for order in orders])
+        shares = np.array([order.shares for order in orders], dtype=float)
+        prices = np.array([order.price for order in orders], dtype=float)
+
+        # Net the orders per (ticker, price), groups are sorted by ticker and then by price
+        _, ticker_ids = np.unique(stocks, return_inverse=True)
+        pairs, first, inverse = np.unique(np.column_stack([ticker_ids, prices]), axis=0,
+                                          return_index=True, return_inverse=True)
+        inverse = inverse.reshape(-1)
+        ticker_ids, tickers, price = pairs[:, 0].astype(int), stocks[first], prices[first]
+        net = np.bincount(inverse, weights=shares, minlength=len(pairs))
+        groups = np.arange(len(pairs))
+
+        valid = np.array([ticker in self._portfolio for ticker in tickers])
+        self._log_failures(orders, np.isin(inverse, groups[~valid]))
+        active = valid & (np.abs(net) > 1e-7)  # Orders which net out are settled without a transaction
+        groups, ticker_ids, tickers, price, net = (
+            values[active] for values in (groups, ticker_ids, tickers, price, net))
+        if len(groups) == 0:
+            return []
+
+        price, net, fees, filled = self._order_api.process_orders(price, net)
+        self._log_failures(orders, np.isin(inverse, groups[~filled]))
+        groups, ticker_ids, tickers, price, net = (
+            values[filled] for values in (groups, ticker_ids, tickers, price, net))
+
+        # Sells can not exceed the current holdings, which are used up by the groups of a ticker in price order
+        held = np.array([self._portfolio.get_shares(ticker) for ticker in tickers], dtype=float)
+        sold = np.maximum(-net, 0.)
+        before = np.cumsum(sold) - sold
+        before -= before[np.searchsorted(ticker_ids, ticker_ids)]  # Shares sold by earlier groups of the ticker
+        net = np.where(net < 0, -np.clip(held - before, 0., sold), net)
+
+        # Sells must cover their own fee
+        fees = self._order_api.calculate_fees(net)
+        sells = (net < -1e-7) & (fees <= -net * price)
+        buys = net > 1e-7
+
+        # Cash headroom for the whole batch, sells settle first
+        available = self._portfolio.cash - np.sum(price[sells] * net[sells] + fees[sells])
+        if buys.any() and np.sum(price[buys] * net[buys] + fees[buys]) >= available:
+            scale = max(available, 0.) / np.sum(price[buys] * net[buys] + fees[buys])
+            net = np.where(buys, np.floor(net * scale), net)
+            fees = self._order_api.calculate_fees(net)
+            buys = net > 1e-7
+            if np.sum(price[buys] * net[buys] + fees[buys]) >= available:
+                buys[:] = False
+
+        executed = sells | buys
+        self._log_failures(orders, np.isin(inverse, groups[~executed]))
+        txns = [Transaction(str(ticker), p, share_delta, fee) for ticker, p, share_delta, fee in
+                zip(tickers[executed], price[executed], net[executed], fees[executed])]
+        self._portfolio.update_trades(txns)
+        self._trades.extend((self._timestamp, txn.stock, txn.price, txn.shares, txn.fee) for txn in txns)
+
+        for txn in txns:
+            if txn.is_buy():
+                self._logger.debug(
+                    'Bought %s for %.1f shares at $%.2f with fee $%.2f' % (txn.stock, txn.shares, txn.price, txn.fee))
+                self._print(
+                    'Bought %s for %.1f shares at $%.2f with fee $%.2f' % (txn.stock, txn.shares, txn.price, txn.fee))
+            else:
+                self._logger.debug(
+                    'Sold %s for %.1f shares at $%.2f with fee $%.2f' % (txn.stock, -txn.shares, txn.price, txn.fee))
+                self._print(
+                    'Sold %s for %.1f shares at $%.2f with fee $%.2f' % (txn.stock, -txn.shares, txn.price, txn.fee))
+
+        return txns
+
+    def _log_failures(self, orders, failed):
+        # Logs the submitted orders selected by the failed mask
+        for order, fail in zip(orders, failed):
+            if fail:
+                message = '%s failed: %s at $%s for %s shares' % (
+                    'Sell' if order.shares < 0 else 'Buy', order.stock, order.price, order.shares)
+                self._logger.info(message)
+                self._print(message)
+
+    def process_receipt(self, receipt):
+        ticker = receipt[0]
+        price = receipt[1]
+        share_delta = receipt[2]
+        fee = receipt[3]
+        temp = self._portfolio.cash - (price * share_delta + fee)
+        if temp > 0:
+            if share_delta < 0 and -share_delta > self._portfolio.get_shares(ticker):
+                # Liquidate
+                share_delta = -self._portfolio.get_shares(ticker)
+                fee = self._order_api.calculate_fee(Order(ticker, price, share_delta))
+                if fee > abs(share_delta * price):
+                    return False
+
+            txn = Transaction(ticker, price, share_delta, fee)
+            self._portfolio.update_trade(txn)
+            self._trades.append((self._timestamp, ticker, price, share_delta, fee))
+            if share_delta > 0:
+                self._logger.debug(
+                    'Bought %s for %.1f shares at $%.2f with fee $%.2f' % (ticker, share_delta, price, fee))
+                self._print('Bought %s for %.1f shares at $%.2f with fee $%.2f' % (ticker, share_delta, price, fee))
+            else:
+                self._logger.debug(
+                    'Sold %s for %.1f shares at $%.2f with fee $%.2f' % (ticker, -share_delta, price, fee))
+                self._print('Sold %s for %.1f shares at $%.2f with fee $%.2f' % (ticker, -share_delta, price, fee))
+
+            return True
+
+        return False
+
+    def _print(self, message):
+        if not self._quiet:
+            print(message)
+
+    def process_pricing(self, ticker, price, timestamp=None):
+        self._portfolio.update(price=price, ticker=ticker)
+        self._algorithm.update(stock=ticker, price=price, timestamp=timestamp)
@@ -0,0 +1,88 @@
+import datetime as dt
+import logging
+
+import numpy as np
+
+
+class DataSource:
+    """
+    Data source for the backtester. Must implement a "get_data" function
+    which streams data from the data source.
+
+    The basic DataSource included is built on top of pandas DataReader.
+    This source may be modified to be any realtime data feed. The DataSource's single requirement is
+    to fill a Queue class with data from the feed. The data should be in the form of a tuple
+    (Timestamp/Id, Ticker str, Price float).
+    """
+
+    def __init__(self, source='yahoo', tickers=None, start=dt.datetime(2016, 1, 1),
+                 end=dt.datetime.today()):
+        if tickers is None:
+            raise ValueError("tickers must not be None")
+        self._source = []
+        self._prices = None
+        self._logger = logging.getLogger(__name__)
+        self.set_source(source=source, tickers=tickers, start=start, end=end)
+
+    @classmethod
+    def process(cls, queue, source=None):
+        source = cls() if source is None else source
+        while True:
+            data = source.get_data()
+            if data is not None:
+                queue.put(data)
+                if data == 'POISON':
+                    break
+
+    def set_source(self, source, tickers, start, end):
+        # pandas is only needed to load the data, so it is not imported with the rest of the engine
+        import pandas as pd
+        from pandas_datareader import DataReader
+
+        prices = pd.DataFrame()
+        counter = 0
+        for ticker in tickers:
+            try:
+                self._logger.info('Loading ticker %.0f%%' % (100.0 * counter / len(tickers)))
+                prices[ticker] = DataReader(ticker, source, start, end).loc[:, 'Close']
+            except Exception as e:
+                self._logger.error(e)
+                pass
+            counter += 1
+
+        history = []
+        for row in prices.iterrows():
+            timestamp = row[0]
+            series = row[1]
+            vals = series.values
+            indx = series.index
+            for k in range(0, len(vals), 1):
+                if np.isfinite(vals[k]):
+                    history.append((timestamp, indx[k], vals[k]))
+
+        self._source = history
+        self._prices = prices
+        self._logger.info('Loaded data!')
+
+    def get_price_matrix(self):
+        # Timestamps, tickers and the (timestamps x tickers) price matrix of the loaded data, NaN where missing
+        return list(self._prices.index), list(self._prices.columns), self._prices.values.astype(float)
+
+    def get_history(self):
+        # Ticks which have not been streamed yet, in the (Timestamp, Ticker, Price) form of get_data
+        return list(self._source)
+
+    def get_data(self):
+        try:
+            return self._source.pop(0)
+        except IndexError:
+            return 'POISON'
+
+
+def bar_offsets(history):
+    """
+    Offsets into a tick history where each timestamp (bar) starts, followed by the length of the history.
+    Ticks of bar k are history[offsets[k]:offsets[k + 1]].
+    """
+    offsets = [k for k in range(len(history)) if k == 0 or history[k][0] != history[k - 1][0]]
+    return np.array(offsets + [len(history)], dtype=int)
@@ -0,0 +1,44 @@
+import numpy as np
+
+
+def equity_metrics(values, balance):
+    """
+    Final value, return, Sharpe ratio and drawdown of an equity curve. The curve starts from the starting balance,
+    so a run which has not traded yet keeps its balance and no return.
+    """
+    values = np.concatenate([[balance], np.asarray(values, dtype=float)])
+    return {
+        'value': values[-1],
+        'return': total_return(values),
+        'sharpe': sharpe_ratio(values),
+        'drawdown': max_drawdown(values),
+    }
+
+
+def total_return(values):
+    values = np.asarray(values, dtype=float)
+    if len(values) < 2 or values[0] <= 0:
+        return 0.
+    return values[-1] / values[0] - 1
+
+
+def sharpe_ratio(values, periods_per_year=252):
+    """
+    Annualized Sharpe ratio of an equity curve sampled once per period, with a zero risk free rate.
+    """
+    values = np.asarray(values, dtype=float)
+    if len(values) < 3:
+        return 0.
+    returns = values[1:] / values[:-1] - 1
+    deviation = np.std(returns, ddof=1)
+    if deviation < 1e-12:
+        return 0.
+    return np.sqrt(periods_per_year) * np.mean(returns) / deviation
+
+
+def max_drawdown(values):
+    # Largest relative drop from a running peak of the equity curve
+    values = np.asarray(values, dtype=float)
+    if len(values) == 0:
+        return 0.
+    return np.max(1 - values / np.maximum.accumulate(values))
@@ -0,0 +1,147 @@
+import logging
+import math
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+from library.algorithm import Algorithm
+from library.portfolio import Portfolio
+from training.controller import Controller, OrderApi
+from training.datasource import bar_offsets
+from training.metrics import equity_metrics
+from training.workers import advance, init_worker, load_history
+
+
+class SuccessiveHalving:
+    """
+    Successive halving over algorithm parameters. Every configuration is run on a short prefix of the data, the best
+    1 / eta of them by final portfolio value or Sharpe ratio are extended to a horizon eta times longer, and so on
+    until a single configuration has seen the full history. Survivors resume from the state they reached instead of
+    replaying the prefix.
+
+    The budget is the total number of simulated bars across all configurations. When the full schedule does not fit
+    all horizons are shortened in proportion, rungs which would add no bars are dropped and a budget which cannot run
+    every configuration for at least one bar per rung is rejected. Configurations are keyword arguments of the
+    algorithm class, the order_api class is instantiated once per configuration.
+    """
+
+    def __init__(self, history, configurations, budget=None, eta=3, metric='value', balance=10000,
+                 algorithm=Algorithm, order_api=OrderApi, workers=None, progress=None) -> None:
+        if len(configurations) == 0:
+            raise ValueError("At least one configuration is required")
+        if eta < 2:
+            raise ValueError("Eta must be at least 2")
+        if metric not in ('value', 'sharpe'):
+            raise ValueError("Metric must be either 'value' or 'sharpe'")
+
+        self._logger = logging.getLogger(__name__)
+        self._history = history
+        self._offsets = bar_offsets(history)
+        self._configurations = list(configurations)
+        self._budget = budget
+        self._eta = eta
+        self._metric = metric
+        self._balance = balance
+        self._algorithm = algorithm
+        self._order_api = order_api
+        self._workers = os.cpu_count() if workers is None else workers
+        self._progress = progress
+
+    @property
+    def bars(self):
+        return len(self._offsets) - 1
+
+    def schedule(self):
+        """
+        Number of configurations and the horizon in bars of each rung.
+        """
+        counts = [len(self._configurations)]
+        while counts[-1] > 1:
+            counts.append(max(1, counts[-1] // self._eta))
+
+        horizons = [self.bars / self._eta ** (len(counts) - 1 - rung) for rung in range(len(counts))]
+        cost = self._cost(counts, horizons)
+        if self._budget is not None and cost > self._budget:
+            horizons = [horizon * self._budget / cost for horizon in horizons]
+        horizons = [min(self.bars, int(math.floor(horizon))) for horizon in horizons]
+
+        # Keep horizons strictly increasing, the first rung always runs every configuration
+        kept_counts, kept_horizons = [], []
+        for count, horizon in zip(counts, horizons):
+            if horizon > (kept_horizons[-1] if len(kept_horizons) > 0 else 0):
+                kept_counts.append(count if len(kept_counts) > 0 else counts[0])
+                kept_horizons.append(horizon)
+
+        if len(kept_horizons) == 0 or \
+                (self._budget is not None and self._cost(kept_counts, kept_horizons) > self._budget):
+            raise ValueError("Budget must cover at least one bar per configuration per rung")
+        return kept_counts, kept_horizons
+
+    @staticmethod
+    def _cost(counts, horizons):
+        return sum(count * (horizon - previous) for count, horizon, previous in zip(counts, horizons, [0] + horizons))
+
+    def run(self):
+        """
+        Returns one entry per configuration with its parameters, the rung and horizon it reached and its metrics,
+        best first.
+        """
+        counts, horizons = self.schedule()
+        candidates = [(k, self._controller(parameters, horizons[0]))
+                      for k, parameters in enumerate(self._configurations)]
+        results = {}
+        reached = 0
+        used = 0
+
+        executor = None
+        if self._workers > 1:
+            executor = ProcessPoolExecutor(
+                max_workers=self._workers, initializer=init_worker,
+                initargs=(self._history, self._offsets, logging.getLogger().getEffectiveLevel()))
+        else:
+            load_history(self._history, self._offsets)
+
+        try:
+            for rung, (count, horizon) in enumerate(zip(counts, horizons)):
+                candidates = candidates[:count]
+                if executor is None:
+                    advanced = (advance(controller, reached, horizon) for _, controller in candidates)
+                else:
+                    futures = [executor.submit(advance, controller, reached, horizon) for _, controller in candidates]
+                    advanced = (future.result() for future in futures)
+
+                completed = []
+                for controller in advanced:
+                    completed.append(controller)
+                    self._report(rung, len(completed), len(candidates), used + len(completed) * (horizon - reached))
+                used += len(candidates) * (horizon - reached)
+
+                candidates = [(k, controller) for (k, _), controller in zip(candidates, completed)]
+                for k, controller in candidates:
+                    results[k] = self._evaluate(k, controller, rung, horizon)
+                candidates.sort(key=lambda candidate: results[candidate[0]][self._metric], reverse=True)
+                reached = horizon
+        finally:
+            if executor is not None:
+                executor.shutdown()
+
+        return sorted(results.values(), key=lambda result: (result['rung'], result[self._metric]), reverse=True)
+
+    def _controller(self, parameters, horizon):
+        algorithm = self._algorithm(**parameters)
+        window = algorithm.parameters()['price_window']
+        if horizon < window:
+            self._logger.warning('First rung of %d bars is shorter than the price window of %d bars, %s can not trade '
+                                 'before it is judged' % (horizon, window, parameters))
+        return Controller(portfolio=Portfolio(self._balance), algorithm=algorithm, order_api=self._order_api(),
+                          quiet=self._workers > 1)
+
+    def _evaluate(self, k, controller, rung, horizon):
+        result = {'parameters': self._configurations[k], 'rung': rung, 'bars': horizon}
+        result.update(equity_metrics(controller.results()['equity_values'], self._balance))
+        return result
+
+    def _report(self, rung, completed, total, used):
+        message = 'Rung %d: %d/%d configurations, %d simulated bars' % (rung, completed, total, used)
+        self._logger.info(message)
+        if self._progress is not None:
+            self._progress(rung, completed, total, used)
@@ -0,0 +1,157 @@
+import copy
+import logging
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from library.algorithm import Algorithm
+from library.portfolio import Portfolio
+from training.controller import Controller, OrderApi
+from training.datasource import bar_offsets
+from training.metrics import equity_metrics
+from training.workers import advance, init_worker, load_history
+
+
+def _evaluate(controller, balance):
+    results = controller.results()
+    metrics = equity_metrics(results['equity_values'], balance)
+    metrics['trades'] = len(results['trade_tickers'])
+    return metrics
+
+
+def _run_fold(train_states, test_states, bounds, metric, balance):
+    """
+    Runs every candidate on the train window, then the best one on the test window. The states are warm
+    controllers positioned at the start of the respective window.
+    """
+    train_start, test_start, test_end = bounds
+    trained = [_evaluate(advance(copy.deepcopy(controller), train_start, test_start), balance)
+               for controller in train_states]
+    best = int(np.argmax([result[metric] for result in trained]))
+    tested = _evaluate(advance(copy.deepcopy(test_states[best]), test_start, test_end), balance)
+    return best, trained[best], tested
+
+
+class WalkForwardReport:
+    """
+    Per-fold train and test metrics of a walk-forward evaluation.
+    """
+
+    def __init__(self, folds) -> None:
+        self._folds = folds
+
+    @property
+    def folds(self):
+        return self._folds
+
+    def summary(self):
+        returns = np.array([fold['test']['return'] for fold in self._folds])
+        return {
+            'folds': len(self._folds),
+            'mean_return': np.mean(returns),
+            'std_return': np.std(returns),
+            'compounded_return': np.prod(1 + returns) - 1,
+            'positive_folds': np.mean(returns > 0),
+            'mean_sharpe': np.mean([fold['test']['sharpe'] for fold in self._folds]),
+            'max_drawdown': np.max([fold['test']['drawdown'] for fold in self._folds]),
+            'trades': sum(fold['test']['trades'] for fold in self._folds),
+        }
+
+    def __str__(self):
+        lines = ['Fold  Test start  Parameters  Train return  Test return  Test sharpe  Drawdown  Trades']
+        for k, fold in enumerate(self._folds):
+            lines.append('%4d  %10s  %10s  %11.2f%%  %10.2f%%  %11.2f  %7.2f%%  %6d' % (
+                k, str(fold['test_start'])[:10], fold['parameters'], 100 * fold['train']['return'],
+                100 * fold['test']['return'], fold['test']['sharpe'], 100 * fold['test']['drawdown'],
+                fold['test']['trades']))
+        summary = self.summary()
+        lines.append('Mean return %.2f%%, compounded %.2f%%, positive folds %.0f%%, mean sharpe %.2f' % (
+            100 * summary['mean_return'], 100 * summary['compounded_return'], 100 * summary['positive_folds'],
+            summary['mean_sharpe']))
+        return '\n'.join(lines)
+
+
+class WalkForward:
+    """
+    Walk-forward evaluation over a tick history loaded once. Fold i fits on train_bars bars, choosing the best of the
+    candidate algorithm parameters, and is tested on the following test_bars bars; folds roll forward by test_bars.
+
+    Warm-up state is built in a single pricing pass per candidate: the controller is snapshotted at the start of every
+    window, so a fold starts with full moving averages instead of replaying its lookback. Each window starts from a
+    portfolio of balance in cash. Folds run in parallel on a process pool.
+    """
+
+    def __init__(self, history, train_bars, test_bars, candidates=({},), metric='value', balance=10000,
+                 algorithm=Algorithm, order_api=OrderApi, workers=None) -> None:
+        if train_bars < 1 or test_bars < 1:
+            raise ValueError("Train and test windows must be Positive")
+        if len(candidates) == 0:
+            raise ValueError("At least one candidate is required")
+        if metric not in ('value', 'sharpe'):
+            raise ValueError("Metric must be either 'value' or 'sharpe'")
+
+        self._logger = logging.getLogger(__name__)
+        self._history = history
+        self._offsets = bar_offsets(history)
+        self._train_bars = train_bars
+        self._test_bars = test_bars
+        self._candidates = list(candidates)
+        self._metric = metric
+        self._balance = balance
+        self._algorithm = algorithm
+        self._order_api = order_api
+        self._workers = os.cpu_count() if workers is None else workers
+
+    def folds(self):
+        # (train start, test start, test end) bar indices of every fold
+        bars = len(self._offsets) - 1
+        return [(start, start + self._train_bars, start + self._train_bars + self._test_bars)
+                for start in range(0, bars - self._train_bars - self._test_bars + 1, self._test_bars)]
+
+    def warm_states(self, boundaries):
+        """
+        Controllers of every candidate, warmed up on the prices before each boundary bar, keyed by boundary.
+        """
+        states = {boundary: [] for boundary in boundaries}
+        for parameters in self._candidates:
+            controller = Controller(portfolio=Portfolio(self._balance), algorithm=self._algorithm(**parameters),
+                                    order_api=self._order_api(), quiet=self._workers > 1)
+            reached = 0
+            for boundary in sorted(boundaries):
+                for timestamp, ticker, price in self._history[self._offsets[reached]:self._offsets[boundary]]:
+                    controller.process_pricing(ticker=ticker, price=price, timestamp=timestamp)
+                states[boundary].append(copy.deepcopy(controller))
+                reached = boundary
+        return states
+
+    def run(self):
+        folds = self.folds()
+        if len(folds) == 0:
+            raise ValueError("History is too short for a single fold")
+
+        states = self.warm_states(set(bound for fold in folds for bound in fold[:2]))
+        jobs = [(states[train_start], states[test_start], (train_start, test_start, test_end), self._metric,
+                 self._balance) for train_start, test_start, test_end in folds]
+
+        if self._workers > 1:
+            with ProcessPoolExecutor(
+                    max_workers=self._workers, initializer=init_worker,
+                    initargs=(self._history, self._offsets, logging.getLogger().getEffectiveLevel())) as executor:
+                futures = [executor.submit(_run_fold, *job) for job in jobs]
+                outcomes = []
+                for future in futures:
+                    outcomes.append(future.result())
+                    self._logger.info('Walk forward: %d/%d folds' % (len(outcomes), len(futures)))
+        else:
+            load_history(self._history, self._offsets)
+            outcomes = [_run_fold(*job) for job in jobs]
+
+        return WalkForwardReport([{
+            'train_start': self._history[self._offsets[train_start]][0],
+            'test_start': self._history[self._offsets[test_start]][0],
+            'test_end': self._history[self._offsets[test_end] - 1][0],
+            'parameters': self._candidates[best],
+            'train': train,
+            'test': test,
+        } for (train_start, test_start, test_end), (best, train, test) in zip(folds, outcomes)])
@@ -0,0 +1,26 @@
+import logging
+
+_history = None
+_offsets = None
+
+
+def load_history(history, offsets):
+    """
+    Makes the tick history and its bar offsets available to advance in this process.
+    """
+    global _history, _offsets
+    _history = history
+    _offsets = offsets
+
+
+def init_worker(history, offsets, level=logging.WARNING):
+    # Pool workers receive the data once and keep it for every run they are given, and log at the parent's level
+    load_history(history, offsets)
+    logging.basicConfig(level=level)
+
+
+def advance(controller, start, end):
+    # Runs the controller from bar start up to, but excluding, bar end
+    for timestamp, ticker, price in _history[_offsets[start]:_offsets[end]]:
+        controller.process_tick(timestamp=timestamp, ticker=ticker, price=price)
+    return controller